@@ -6,7 +6,7 @@ import uvicorn
 import os
 import tempfile
 import shutil
-import threading
+import asyncio
 from pptx import Presentation
 from mistralai import Mistral
 
@@ -39,6 +39,22 @@ try:
 except Exception as e:
     print(f"⚠️ Failed to initialize Mistral client: {e}")
 
+# Maximum number of concurrent Mistral OCR requests per PPTX
+OCR_CONCURRENCY_LIMIT = int(os.environ.get("OCR_CONCURRENCY_LIMIT", "16"))
+
+# PDFs larger than this (bytes) are opened from a temp file instead of memory
+PDF_IN_MEMORY_LIMIT = int(os.environ.get(
+    "PDF_IN_MEMORY_LIMIT", str(16 * 1024 * 1024)))
+
+# Precompiled patterns for clean_ocr_text
+_IMG_REF_RE = re.compile(r'!\[img-\d+\.\w+\]\(img-\d+\.\w+\)')
+_HEADER_RE = re.compile(r'^#{1,6}\s*', re.MULTILINE)
+_BOLD_STAR_RE = re.compile(r'\*\*([^*]+)\*\*')
+_ITALIC_STAR_RE = re.compile(r'\*([^*]+)\*')
+_BOLD_UNDERSCORE_RE = re.compile(r'__([^_]+)__')
+_ITALIC_UNDERSCORE_RE = re.compile(r'_([^_]+)_')
+_BULLET_RE = re.compile(r'^\s*[-*+]\s+', re.MULTILINE)
+
 
 @app.get("/health")
 async def health_check():
@@ -54,6 +70,7 @@ async def extract_pdf_text(file: UploadFile = File(...)):
     Returns structured text with page information and metadata
     """
     start_time = time.time()
+    temp_path = None
 
     try:
         # Validate file type
@@ -61,27 +78,36 @@ async def extract_pdf_text(file: UploadFile = File(...)):
             raise HTTPException(
                 status_code=400, detail="Only PDF files are supported")
 
-        # Read file content
-        pdf_content = await file.read()
-
-        # Open PDF with PyMuPDF - maximum speed settings
-        pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
+        # Open PDF with PyMuPDF - small files from memory, large files from
+        # disk so pages are read on demand instead of holding the whole PDF
+        if file.size is not None and file.size > PDF_IN_MEMORY_LIMIT:
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as buffer:
+                temp_path = buffer.name
+                shutil.copyfileobj(file.file, buffer)
+            pdf_document = fitz.open(temp_path, filetype="pdf")
+        else:
+            pdf_content = await file.read()
+            pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
 
         # Ultra-fast text extraction - minimal object creation
-        pages_text = []
-        total_chars = 0
         page_count = pdf_document.page_count
+        pages_text = [None] * page_count
+        total_chars = 0
 
-        # Optimized loop - pre-allocate and minimal operations
+        # Optimized loop - pre-allocated list, write by index
         for page_num in range(page_count):
-            page_text = pdf_document[page_num].get_text()
+            # Plain "text" mode skips bbox/dict building; drop the page
+            # right away so its C-side resources are freed per iteration
+            page = pdf_document.load_page(page_num)
+            page_text = page.get_text("text")
+            page = None
             char_count = len(page_text)
 
-            pages_text.append({
+            pages_text[page_num] = {
                 "page_number": page_num + 1,
                 "text": page_text,
                 "char_count": char_count
-            })
+            }
             total_chars += char_count
 
         # Minimal metadata - only what's needed
@@ -122,12 +148,20 @@ async def extract_pdf_text(file: UploadFile = File(...)):
         raise HTTPException(
             status_code=500, detail=f"PDF processing failed: {str(e)}")
 
+    finally:
+        # Cleanup temporary PDF copy
+        if temp_path and os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except Exception as e:
+                print(f"⚠️ Failed to cleanup temp file: {e}")
+
 
-def extract_images_from_pptx(pptx_path, temp_dir):
-    """Extract images from PPTX file and return list of image paths"""
+def extract_images_from_pptx(pptx_file):
+    """Extract images from PPTX file and return list of (filename, blob) tuples"""
     try:
-        prs = Presentation(pptx_path)
-        image_paths = []
+        prs = Presentation(pptx_file)
+        images = []
         image_count = 0
 
         for slide_num, slide in enumerate(prs.slides, 1):
@@ -138,18 +172,13 @@ def extract_images_from_pptx(pptx_path, temp_dir):
                         ext = image.ext
                         image_count += 1
                         image_filename = f"slide_{slide_num}_image_{image_count}.{ext}"
-                        image_path = os.path.join(temp_dir, image_filename)
-
-                        with open(image_path, "wb") as f:
-                            f.write(image.blob)
-
-                        image_paths.append(image_path)
+                        images.append((image_filename, image.blob))
                     except Exception as e:
                         print(
                             f"⚠️ Failed to extract image from slide {slide_num}: {e}")
                         continue
 
-        return image_paths
+        return images
     except Exception as e:
         raise Exception(f"Failed to extract images from PPTX: {e}")
 
@@ -160,67 +189,39 @@ def clean_ocr_text(text):
         return ""
 
     # Remove image references like ![img-0.jpeg](img-0.jpeg)
-    text = re.sub(r'!\[img-\d+\.\w+\]\(img-\d+\.\w+\)', '', text)
+    text = _IMG_REF_RE.sub('', text)
 
     # Remove markdown headers - convert to plain text
-    text = re.sub(r'^#{1,6}\s*', '', text,
-                  flags=re.MULTILINE)  # Remove # headers
+    text = _HEADER_RE.sub('', text)  # Remove # headers
 
     # Remove markdown bold/italic formatting
-    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)  # Remove **bold**
-    text = re.sub(r'\*([^*]+)\*', r'\1', text)      # Remove *italic*
-    text = re.sub(r'__([^_]+)__', r'\1', text)      # Remove __bold__
-    text = re.sub(r'_([^_]+)_', r'\1', text)        # Remove _italic_
+    text = _BOLD_STAR_RE.sub(r'\1', text)          # Remove **bold**
+    text = _ITALIC_STAR_RE.sub(r'\1', text)        # Remove *italic*
+    text = _BOLD_UNDERSCORE_RE.sub(r'\1', text)    # Remove __bold__
+    text = _ITALIC_UNDERSCORE_RE.sub(r'\1', text)  # Remove _italic_
 
     # Convert markdown bullet points to simple bullets
-    text = re.sub(r'^\s*[-*+]\s+', '• ', text, flags=re.MULTILINE)
-
-    # Clean up excessive whitespace
-    text = re.sub(r'\s+', ' ', text)  # Multiple spaces to single space
-    # Multiple newlines to double
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
-
-    # Clean up line breaks and remove empty lines, but preserve structure
-    lines = text.split('\n')
-    cleaned_lines = []
-    prev_was_empty = False
-
-    for line in lines:
-        stripped_line = line.strip()
-
-        # Keep empty lines for structure, but not more than 1 consecutive
-        if not stripped_line:
-            if not prev_was_empty:
-                cleaned_lines.append('')
-            prev_was_empty = True
-        else:
-            cleaned_lines.append(stripped_line)
-            prev_was_empty = False
-
-    # Join and final cleanup
-    result = '\n'.join(cleaned_lines).strip()
-
-    # Final cleanup - ensure no excessive spacing
-    result = re.sub(r'\n\n+', '\n\n', result)  # Max 2 consecutive newlines
+    text = _BULLET_RE.sub('• ', text)
 
-    return result
+    # Collapse all whitespace runs (including newlines) to a single space
+    # and trim the ends - str.split() does both in one C pass
+    return ' '.join(text.split())
 
 
-def ocr_image_with_mistral(image_path, client):
-    """Process a single image with Mistral OCR"""
+async def ocr_image_with_mistral(image_name, image_blob, client):
+    """Process a single in-memory image with Mistral OCR"""
     try:
         start = time.time()
 
-        with open(image_path, "rb") as f:
-            uploaded_img = client.files.upload(
-                file={
-                    "file_name": os.path.basename(image_path),
-                    "content": f,
-                },
-                purpose="ocr"
-            )
+        uploaded_img = await client.files.upload_async(
+            file={
+                "file_name": image_name,
+                "content": image_blob,
+            },
+            purpose="ocr"
+        )
 
-        ocr_response = client.ocr.process(
+        ocr_response = await client.ocr.process_async(
             model="mistral-ocr-latest",
             document={
                 "type": "file",
@@ -253,7 +254,7 @@ def ocr_image_with_mistral(image_path, client):
         ocr_text = clean_ocr_text(ocr_text.strip())
 
         return {
-            "image_path": os.path.basename(image_path),
+            "image_path": image_name,
             "text": ocr_text,
             "processing_time": elapsed,
             "char_count": len(ocr_text)
@@ -261,33 +262,27 @@ def ocr_image_with_mistral(image_path, client):
 
     except Exception as e:
         return {
-            "image_path": os.path.basename(image_path),
+            "image_path": image_name,
             "text": f"[OCR Error: {str(e)}]",
             "processing_time": 0,
             "char_count": 0
         }
 
 
-def process_images_parallel(image_paths, client):
-    """Process multiple images with Mistral OCR in parallel"""
+async def process_images_parallel(images, client, limit=OCR_CONCURRENCY_LIMIT):
+    """Process multiple images with Mistral OCR concurrently"""
     if not client:
         raise Exception("Mistral client not initialized")
 
-    results = [None] * len(image_paths)
-    threads = []
+    semaphore = asyncio.Semaphore(limit)
 
-    def ocr_worker(idx, image_path):
-        results[idx] = ocr_image_with_mistral(image_path, client)
+    async def ocr_worker(image_name, image_blob):
+        async with semaphore:
+            return await ocr_image_with_mistral(image_name, image_blob, client)
 
-    # Start all threads
-    for idx, image_path in enumerate(image_paths):
-        thread = threading.Thread(target=ocr_worker, args=(idx, image_path))
-        threads.append(thread)
-        thread.start()
-
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
+    # Run all OCR requests on the event loop, results keep input order
+    results = await asyncio.gather(
+        *[ocr_worker(image_name, image_blob) for image_name, image_blob in images])
 
     return [r for r in results if r is not None]
 
@@ -299,7 +294,6 @@ async def process_pptx(file: UploadFile = File(...)):
     Returns structured text with image OCR results and metadata
     """
     start_time = time.time()
-    temp_dir = None
 
     try:
         # Validate file type
@@ -311,19 +305,11 @@ async def process_pptx(file: UploadFile = File(...)):
             raise HTTPException(
                 status_code=500, detail="Mistral OCR service not available - MISTRAL_API_KEY not configured")
 
-        # Create temporary directory for processing
-        temp_dir = tempfile.mkdtemp()
-
-        # Save uploaded file
-        pptx_path = os.path.join(temp_dir, file.filename)
-        with open(pptx_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # Extract images from PPTX
+        # Extract images straight from the uploaded file - no temp files
         print(f"🖼️ Extracting images from {file.filename}...")
-        image_paths = extract_images_from_pptx(pptx_path, temp_dir)
+        images = extract_images_from_pptx(file.file)
 
-        if not image_paths:
+        if not images:
             # No images found, return minimal response
             return {
                 "success": True,
@@ -345,11 +331,11 @@ async def process_pptx(file: UploadFile = File(...)):
                 "extraction_method": "pptx_image_ocr"
             }
 
-        print(f"📊 Found {len(image_paths)} images, starting OCR processing...")
+        print(f"📊 Found {len(images)} images, starting OCR processing...")
 
         # Process all images with OCR in parallel
         ocr_start = time.time()
-        ocr_results = process_images_parallel(image_paths, mistral_client)
+        ocr_results = await process_images_parallel(images, mistral_client)
         ocr_time = time.time() - ocr_start
 
         # Combine all OCR results into pages
@@ -392,7 +378,7 @@ async def process_pptx(file: UploadFile = File(...)):
             "metadata": {
                 "total_pages": len(pages),
                 "total_characters": total_chars,
-                "images_processed": len(image_paths),
+                "images_processed": len(images),
                 "pdf_conversion_time": 0,  # Not applicable for PPTX
                 "ocr_processing_time": round(ocr_time, 3),
                 "source_type": "pptx_images"
@@ -412,14 +398,6 @@ async def process_pptx(file: UploadFile = File(...)):
         raise HTTPException(
             status_code=500, detail=f"PPTX processing failed: {str(e)}")
 
-    finally:
-        # Cleanup temporary directory
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                print(f"⚠️ Failed to cleanup temp directory: {e}")
-
 
 @app.get("/")
 async def root():